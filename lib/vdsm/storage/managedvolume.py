@@ -168,7 +168,7 @@ def volumes_info(vol_ids=()):
     Returns:
             List of managed volumes information.
     """
-    db = managedvolumedb.open()
+    db = managedvolumedb.open(readonly=True)
     with closing(db):
         result = []
         for vol_info in db.iter_volumes(vol_ids):
@@ -30,14 +30,21 @@ import logging
 import os
 import sqlite3
 from contextlib import closing
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import quote
 
 from vdsm.common import errors
 from vdsm.storage.constants import P_VDSM_LIB
 
 
-VERSION = 1
+VERSION = 2
 DB_FILE = os.path.join(P_VDSM_LIB, "managedvolume.db")
 
+# Seconds to wait for a lock held by another connection before failing with
+# "database is locked".
+BUSY_TIMEOUT = 30
+
 log = logging.getLogger("storage.managevolumedb")
 
 
@@ -64,9 +71,39 @@ class Closed(errors.Base):
     msg = "Operation on closed database connection"
 
 
-def open():
-    conn = sqlite3.connect(DB_FILE)
+def open(readonly=False):
+    """
+    Open the managed volumes database.
+
+    If readonly is True, the database is opened in read only mode. Use this
+    for callers that only look up volumes. A read only connection cannot
+    checkpoint the write-ahead log, so the "-wal" and "-shm" files may be
+    left next to DB_FILE after it is closed.
+    """
+    # Use autocommit mode; sqlite3 module does not begin transactions
+    # implicitly, and DB.transaction() begins them explicitly.
+    if readonly:
+        uri = "file:{}?mode=ro".format(quote(DB_FILE))
+        conn = sqlite3.connect(
+            uri,
+            timeout=BUSY_TIMEOUT,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None,
+            uri=True)
+    else:
+        conn = sqlite3.connect(
+            DB_FILE,
+            timeout=BUSY_TIMEOUT,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None)
+        # Journal mode is persistent and is set when creating the database,
+        # but we set it here as well for databases created by older versions.
+        conn.execute("PRAGMA journal_mode=WAL")
     conn.row_factory = sqlite3.Row
+    # In WAL mode, NORMAL is safe from corruption and syncs only during
+    # checkpoints instead of on every commit.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
     return DB(conn)
 
 
@@ -78,7 +115,8 @@ def create_db():
             connection_info TEXT,
             attachment TEXT,
             multipath_id TEXT,
-            updated datetime);
+            updated datetime
+        ) WITHOUT ROWID;
 
         CREATE UNIQUE INDEX multipath_id ON volumes (multipath_id);
 
@@ -104,18 +142,87 @@ def create_db():
     conn = sqlite3.connect(DB_FILE)
     with closing(conn):
         conn.executescript(create_table % VERSION)
+        # Use write-ahead log so readers do not block writers and writers do
+        # not block readers.
+        conn.execute("PRAGMA journal_mode=WAL")
+
+
+def migrate():
+    """
+    Upgrade the database created by an older version to VERSION.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT)
+    with closing(conn):
+        res = conn.execute("SELECT max(version) FROM versions")
+        current = res.fetchone()[0]
+
+        for version, description, script in _MIGRATIONS:
+            if version <= current:
+                continue
+
+            log.info("Upgrading managed volume DB in %s to version %d",
+                     DB_FILE, version)
+
+            # The entire migration, including the version update, is
+            # committed in a single transaction.
+            conn.executescript("""
+                BEGIN IMMEDIATE;
+                {script}
+                INSERT INTO versions (
+                    version,
+                    description,
+                    updated
+                )
+                VALUES (
+                    {version},
+                    "{description}",
+                    datetime("now")
+                );
+                COMMIT;
+            """.format(script=script, version=version,
+                       description=description))
 
 
 class DB(object):
+    """
+    Connection to the managed volumes database.
+
+    All statements use constant SQL text with parameters, so the sqlite3
+    statement cache compiles every statement only once per connection. Keep
+    it this way; formatting values into the SQL text would compile a new
+    statement on every call.
+    """
 
     def __init__(self, conn):
         self._conn = conn
 
     def close(self):
         if self._conn is not _CLOSED_CONNECTION:
+            # Update query planner statistics if the queries run using this
+            # connection can benefit from it. Usually this does nothing.
+            try:
+                self._conn.execute("PRAGMA optimize")
+            except sqlite3.Error as e:
+                log.warning("Error optimizing database: %s", e)
             self._conn.close()
             self._conn = _CLOSED_CONNECTION
 
+    @contextmanager
+    def transaction(self):
+        """
+        Run all operations in the block in a single transaction. The
+        transaction is committed when the block ends, or rolled back if the
+        block raises. If a transaction is already in progress, the block joins
+        it.
+        """
+        if self._conn.in_transaction:
+            yield
+            return
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        with self._conn:
+            yield
+
     def get_volume(self, vol_id):
         for vol in self.iter_volumes([vol_id]):
             return vol
@@ -180,19 +287,73 @@ class DB(object):
         log.info("Adding volume %s connection_info=%s",
                  vol_id, connection_info)
 
-        conn_info_json = json.dumps(connection_info).encode("utf-8")
+        conn_info_json = _dump_json(connection_info)
 
         try:
-            with self._conn:
+            with self.transaction():
                 self._conn.execute(sql, (vol_id, conn_info_json))
         except sqlite3.IntegrityError:
             raise VolumeAlreadyExists(vol_id, connection_info)
 
+    def add_volumes(self, volumes):
+        """
+        Add many volumes in a single transaction.
+
+        Arguments:
+            volumes (iterable): (vol_id, connection_info) tuples.
+
+        Raises VolumeAlreadyExists if any of the volumes exists; in this case
+        no volume is added.
+        """
+        volumes = list(volumes)
+
+        log.info("Adding %d volumes", len(volumes))
+
+        seen = set()
+        for vol_id, connection_info in volumes:
+            if vol_id in seen:
+                raise VolumeAlreadyExists(vol_id, connection_info)
+            seen.add(vol_id)
+
+        # Insert as many rows as possible in one statement, limited by the
+        # maximum number of parameters.
+        batch_size = _MAX_VARIABLES // 2
+
+        with self.transaction():
+            for i in range(0, len(volumes), batch_size):
+                batch = volumes[i:i + batch_size]
+                self._add_batch(batch)
+
+    def _add_batch(self, batch):
+        sql = """
+            INSERT INTO volumes (
+                vol_id,
+                connection_info)
+            VALUES {values}
+        """.format(values=", ".join("(?, ?)" for _ in batch))
+
+        params = []
+        for vol_id, connection_info in batch:
+            conn_info_json = _dump_json(connection_info)
+            params.append(vol_id)
+            params.append(conn_info_json)
+
+        try:
+            self._conn.execute(sql, params)
+        except sqlite3.IntegrityError:
+            # The failed statement did not insert anything, so the volume
+            # must exist from before.
+            existing = dict(batch)
+            for vol in self.iter_volumes(list(existing)):
+                vol_id = vol["vol_id"]
+                raise VolumeAlreadyExists(vol_id, existing[vol_id])
+            raise
+
     def remove_volume(self, vol_id):
         sql = "DELETE FROM volumes WHERE vol_id = ?"
 
         log.info("Removing volume %s", vol_id)
-        with self._conn:
+        with self.transaction():
             self._conn.execute(sql, (vol_id,))
 
     def update_volume(self, vol_id, path, attachment, multipath_id):
@@ -208,26 +369,20 @@ class DB(object):
         log.info("Updating volume %s path=%s, attachment=%s, multipath_id=%s",
                  vol_id, path, attachment, multipath_id)
 
-        attachment_json = json.dumps(attachment).encode("utf-8")
+        attachment_json = _dump_json(attachment)
 
-        with self._conn:
-            self._conn.execute(sql, (path, attachment_json, multipath_id,
-                                     vol_id))
+        with self.transaction():
+            res = self._conn.execute(sql, (path, attachment_json,
+                                           multipath_id, vol_id))
+            if res.rowcount == 0:
+                raise NotFound(vol_id)
 
     def owns_multipath(self, multipath_id):
         """
         Return True if multipath device is owned by a managed volume.
         """
-        sql = """
-            SELECT EXISTS (
-                SELECT 1
-                FROM volumes
-                WHERE multipath_id = ?
-            )
-        """
-        res = self._conn.execute(sql, (multipath_id,))
-        row = res.fetchall()[0]
-        return row[0] == 1
+        res = self._conn.execute(_OWNS_MULTIPATH_SQL, (multipath_id,))
+        return res.fetchone()[0] == 1
 
     def version_info(self):
         sql = """
@@ -246,6 +401,68 @@ class DB(object):
 
 # Private
 
+# Module constant so tests can check the query plan.
+_OWNS_MULTIPATH_SQL = """
+    SELECT EXISTS (
+        SELECT 1
+        FROM volumes
+        WHERE multipath_id = ?
+    )
+"""
+
+
+def _dump_json(obj):
+    """
+    Serialize obj to compact JSON, stored as a BLOB.
+    """
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _convert_datetime(value):
+    """
+    Convert "datetime" columns, stored by SQLite datetime() as
+    "YYYY-MM-DD HH:MM:SS" UTC, to naive datetime.datetime.
+    """
+    return datetime.strptime(value.decode("utf-8"), "%Y-%m-%d %H:%M:%S")
+
+
+# Converters are global to the sqlite3 module, so this affects every
+# connection in the process opened with detect_types=PARSE_DECLTYPES that
+# reads a column declared "datetime". The name must match the declared type
+# of the existing columns of this database.
+sqlite3.register_converter("datetime", _convert_datetime)
+
+# Schema upgrades, (version, description, script), ordered by version.
+_MIGRATIONS = [
+    (2, "Store volumes in WITHOUT ROWID table", """
+        CREATE TABLE volumes_new (
+            vol_id TEXT PRIMARY KEY,
+            path TEXT,
+            connection_info TEXT,
+            attachment TEXT,
+            multipath_id TEXT,
+            updated datetime
+        ) WITHOUT ROWID;
+
+        -- Version 1 primary key accepted NULL, but such volumes cannot be
+        -- looked up or removed, and the new primary key rejects them.
+        INSERT INTO volumes_new
+        SELECT vol_id, path, connection_info, attachment, multipath_id, updated
+        FROM volumes
+        WHERE vol_id IS NOT NULL;
+
+        DROP TABLE volumes;
+
+        ALTER TABLE volumes_new RENAME TO volumes;
+
+        CREATE UNIQUE INDEX multipath_id ON volumes (multipath_id);
+    """),
+]
+
+# Default maximum number of parameters in a single statement.
+_MAX_VARIABLES = 999
+
+
 class _closed_connection(object):
 
     def __getattr__(self, name):
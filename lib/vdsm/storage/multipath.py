@@ -512,7 +512,7 @@ def getMPDevsIter():
 
     Return the list of device identifiers w/o "/dev/mapper" prefix
     """
-    db = managedvolumedb.open()
+    db = managedvolumedb.open(readonly=True)
     with closing(db):
         for dmInfoDir in glob(SYS_BLOCK + "/dm-*/dm/"):
             uuidFile = os.path.join(dmInfoDir, "uuid")
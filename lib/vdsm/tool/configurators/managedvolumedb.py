@@ -52,7 +52,11 @@ def configure():
         if not _db_owned_by_vdsm():
             _set_db_ownership()
         if not _db_version_correct():
-            raise IncorrectDBVersion
+            sys.stdout.write("Upgrading managed volumes database at %s\n" %
+                             mvdb.DB_FILE)
+            mvdb.migrate()
+            if not _db_version_correct():
+                raise IncorrectDBVersion
 
 
 def isconfigured():
@@ -71,9 +75,12 @@ def removeConf():
     """
     Remove database file
     """
-    if os.path.isfile(mvdb.DB_FILE):
-        sys.stdout.write("Removing database file %s\n" % mvdb.DB_FILE)
-        os.remove(mvdb.DB_FILE)
+    # The write-ahead log and shared memory files may be left after read only
+    # connections, which cannot checkpoint the database.
+    for path in (mvdb.DB_FILE, mvdb.DB_FILE + "-wal", mvdb.DB_FILE + "-shm"):
+        if os.path.isfile(path):
+            sys.stdout.write("Removing database file %s\n" % path)
+            os.remove(path)
 
 
 def _set_db_ownership():
@@ -70,6 +70,40 @@ class TestHooking(object):
 
         assert xml_equal(domxml.toprettyxml(), self._EXPECTED_XML)
 
+    def test_roundtrip_domxml_tree(self, monkeypatch):
+        data = self._EXPECTED_XML.replace(
+            '<metadata />',
+            '<metadata><ovirt:qos /></metadata>')
+
+        with temporaryPath(data=data.encode('utf-8')) as path:
+            monkeypatch.setenv('_hook_domxml', path)
+            tree = hooking.read_domxml_tree()
+            hooking.write_domxml_tree(tree)
+
+            with io.open(path, 'r') as src:
+                found_xml = src.read()
+
+        assert xml_equal(found_xml, data)
+        # Namespace prefix is kept.
+        assert '<ovirt:qos />' in found_xml
+
+    def test_roundtrip_domxml_tree_nested_default_namespace(self, monkeypatch):
+        data = self._EXPECTED_XML.replace(
+            '<metadata />',
+            '<metadata><app xmlns="http://x"><a /></app></metadata>')
+
+        with temporaryPath(data=data.encode('utf-8')) as path:
+            monkeypatch.setenv('_hook_domxml', path)
+            tree = hooking.read_domxml_tree()
+            hooking.write_domxml_tree(tree)
+
+            found = ET.parse(path).getroot()
+
+        # Domain elements stay in no namespace.
+        assert found.tag == 'domain'
+        assert found.find('devices') is not None
+        assert found.find('metadata/{http://x}app/{http://x}a') is not None
+
 
 # TODO: replace this and assertXMLEqual with better approach
 def xml_equal(actual_xml, expected_xml):
@@ -25,6 +25,7 @@ from __future__ import print_function
 import binascii
 import json
 import os
+import sqlite3
 import time
 import uuid
 
@@ -35,6 +36,7 @@ import pytest
 
 from vdsm.common import concurrent
 from vdsm.storage import managedvolumedb
+from vdsm.tool.configurators import managedvolumedb as configurator
 
 
 @pytest.fixture
@@ -59,6 +61,14 @@ def test_create_db(db_path):
             db.get_volume("something")
 
 
+def test_journal_mode(db_path):
+    managedvolumedb.create_db()
+    conn = sqlite3.connect(db_path)
+    with closing(conn):
+        res = conn.execute("PRAGMA journal_mode")
+        assert res.fetchone()[0] == "wal"
+
+
 def test_version_info(db_path):
     # sqlite doesn't store microseconds, so any non-zero value here can fail
     # the test
@@ -71,8 +81,142 @@ def test_version_info(db_path):
 
     assert managedvolumedb.VERSION == curr_version["version"]
     assert "Initial version" == curr_version["description"]
-    assert start <= datetime.strptime(curr_version["updated"],
-                                      "%Y-%m-%d %H:%M:%S")
+    assert start <= curr_version["updated"]
+
+
+def test_readonly(tmp_db):
+    db = managedvolumedb.open()
+    with closing(db):
+        db.add_volume("vol-1", {"connection": 1})
+
+    db = managedvolumedb.open(readonly=True)
+    with closing(db):
+        assert db.get_volume("vol-1") == {
+            "vol_id": "vol-1", "connection_info": {"connection": 1}}
+
+        with pytest.raises(sqlite3.OperationalError):
+            db.add_volume("vol-2", {"connection": 2})
+
+
+@pytest.fixture
+def v1_db(db_path):
+    """
+    Create version 1 database with one volume.
+    """
+    conn = sqlite3.connect(db_path)
+    with closing(conn):
+        conn.executescript("""
+            CREATE TABLE volumes (
+                vol_id TEXT PRIMARY KEY,
+                path TEXT,
+                connection_info TEXT,
+                attachment TEXT,
+                multipath_id TEXT,
+                updated datetime);
+
+            CREATE UNIQUE INDEX multipath_id ON volumes (multipath_id);
+
+            CREATE TABLE versions (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                updated datetime
+            );
+
+            INSERT INTO versions (version, description, updated)
+            VALUES (1, "Initial version", datetime("now"));
+
+            INSERT INTO volumes (
+                vol_id,
+                path,
+                connection_info,
+                attachment,
+                multipath_id,
+                updated
+            )
+            VALUES (
+                "vol-1",
+                "/dev/mapper/mpath-1",
+                '{"connection": 1}',
+                '{"attachment": 1}',
+                "mpath-1",
+                datetime("now")
+            );
+        """)
+    return db_path
+
+
+def check_migrated_volume():
+    db = managedvolumedb.open()
+    with closing(db):
+        assert db.version_info()["version"] == managedvolumedb.VERSION
+        assert db.get_volume("vol-1") == {
+            "vol_id": "vol-1",
+            "connection_info": {"connection": 1},
+            "path": "/dev/mapper/mpath-1",
+            "attachment": {"attachment": 1},
+            "multipath_id": "mpath-1",
+        }
+        assert db.owns_multipath("mpath-1")
+
+
+def test_migrate(v1_db):
+    managedvolumedb.migrate()
+    check_migrated_volume()
+
+
+def test_migrate_null_vol_id(v1_db):
+    # Version 1 primary key accepted NULL, but such row cannot be used.
+    conn = sqlite3.connect(v1_db)
+    with closing(conn):
+        with conn:
+            conn.execute("""
+                INSERT INTO volumes (vol_id, connection_info)
+                VALUES (NULL, '{"connection": 2}')
+            """)
+
+    managedvolumedb.migrate()
+    check_migrated_volume()
+
+    db = managedvolumedb.open()
+    with closing(db):
+        vol_ids = [vol["vol_id"] for vol in db.iter_volumes()]
+        assert vol_ids == ["vol-1"]
+
+
+def test_configure_upgrade(v1_db, monkeypatch):
+    monkeypatch.setattr(configurator, "_db_owned_by_vdsm", lambda: True)
+
+    assert configurator.isconfigured() == configurator.NO
+    configurator.configure()
+    assert configurator.isconfigured() == configurator.YES
+
+    check_migrated_volume()
+
+
+def test_migrate_current(tmp_db):
+    managedvolumedb.migrate()
+
+    db = managedvolumedb.open()
+    with closing(db):
+        version = db.version_info()
+        assert version["version"] == managedvolumedb.VERSION
+        assert version["description"] == "Initial version"
+
+
+def test_remove_conf(tmp_db, db_path):
+    db = managedvolumedb.open()
+    with closing(db):
+        db.add_volume("vol-1", {"connection": 1})
+
+    # Read only connection leaves the write-ahead log files.
+    db = managedvolumedb.open(readonly=True)
+    with closing(db):
+        db.get_volume("vol-1")
+
+    configurator.removeConf()
+
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        assert not os.path.exists(path)
 
 
 def test_close(tmp_db):
@@ -117,6 +261,47 @@ def test_insert_existing(tmp_db):
             db.add_volume(test_id, connection_info2)
 
 
+def test_add_volumes(tmp_db):
+    # Use more volumes than fit in a single insert statement.
+    expected = [{"vol_id": "vol-%04d" % i,
+                 "connection_info": {"connection": i}}
+                for i in range(1200)]
+
+    db = managedvolumedb.open()
+    with closing(db):
+        db.add_volumes(
+            (vol["vol_id"], vol["connection_info"]) for vol in expected)
+
+        actual = list(db.iter_volumes())
+        assert expected == actual
+
+
+def test_add_volumes_existing(tmp_db):
+    db = managedvolumedb.open()
+    with closing(db):
+        db.add_volume("vol-2", {"connection": 2})
+
+        volumes = [("vol-%d" % i, {"connection": i}) for i in range(1, 4)]
+        with pytest.raises(managedvolumedb.VolumeAlreadyExists) as e:
+            db.add_volumes(volumes)
+
+        assert e.value.vol_id == "vol-2"
+
+        # No volume was added.
+        vol_ids = [vol["vol_id"] for vol in db.iter_volumes()]
+        assert vol_ids == ["vol-2"]
+
+
+def test_add_volumes_duplicate(tmp_db):
+    db = managedvolumedb.open()
+    with closing(db):
+        volumes = [("vol-1", {"connection": 1}), ("vol-1", {"connection": 2})]
+        with pytest.raises(managedvolumedb.VolumeAlreadyExists):
+            db.add_volumes(volumes)
+
+        assert list(db.iter_volumes()) == []
+
+
 def test_get_non_existing(tmp_db):
     db = managedvolumedb.open()
     with closing(db):
@@ -146,6 +331,17 @@ def test_update(tmp_db):
         assert res == expected
 
 
+def test_update_non_existing(tmp_db):
+    db = managedvolumedb.open()
+    with closing(db):
+        with pytest.raises(managedvolumedb.NotFound):
+            db.update_volume(
+                "this doesn't exists",
+                "/dev/mapper/36001405376e34ea70384de7a34a2854d",
+                {"attachment": 2},
+                "36001405376e34ea70384de7a34a2854d")
+
+
 def test_delete(tmp_db):
     connection_info = {"key": "value"}
     test_id = str(uuid.uuid4())
@@ -162,6 +358,57 @@ def test_delete(tmp_db):
             db.get_volume(test_id)
 
 
+def test_transaction(tmp_db):
+    db = managedvolumedb.open()
+    with closing(db):
+        with db.transaction():
+            db.add_volume("vol-1", {"connection": 1})
+            db.update_volume("vol-1", "/dev/mapper/mpath-1",
+                             {"attachment": 1}, "mpath-1")
+            db.add_volume("vol-2", {"connection": 2})
+
+    db = managedvolumedb.open()
+    with closing(db):
+        vol_ids = [vol["vol_id"] for vol in db.iter_volumes()]
+        assert vol_ids == ["vol-1", "vol-2"]
+        assert db.owns_multipath("mpath-1")
+
+
+def test_autocommit(tmp_db):
+    db = managedvolumedb.open()
+    with closing(db):
+        assert db._conn.isolation_level is None
+
+        # A statement executed outside of DB.transaction() must not leave an
+        # implicit transaction open.
+        db._conn.execute("""
+            INSERT INTO volumes (vol_id, connection_info)
+            VALUES ("vol-1", '{"connection": 1}')
+        """)
+        assert not db._conn.in_transaction
+
+        # And it is visible to other connections without a commit.
+        other = managedvolumedb.open()
+        with closing(other):
+            assert other.get_volume("vol-1") == {
+                "vol_id": "vol-1", "connection_info": {"connection": 1}}
+
+
+def test_transaction_rollback(tmp_db):
+    db = managedvolumedb.open()
+    with closing(db):
+        db.add_volume("vol-1", {"connection": 1})
+
+        with pytest.raises(managedvolumedb.VolumeAlreadyExists):
+            with db.transaction():
+                db.add_volume("vol-2", {"connection": 2})
+                db.add_volume("vol-1", {"connection": 1})
+
+        # Adding vol-2 was rolled back.
+        vol_ids = [vol["vol_id"] for vol in db.iter_volumes()]
+        assert vol_ids == ["vol-1"]
+
+
 def test_owns_multipath(tmp_db):
     vol_id = str(uuid.uuid4())
     connection_info = {"connection": 1}
@@ -187,6 +434,24 @@ def test_owns_multipath(tmp_db):
         assert not db.owns_multipath(multipath_id)
 
 
+def test_owns_multipath_uses_index(db_path):
+    managedvolumedb.create_db()
+    conn = sqlite3.connect(db_path)
+    with closing(conn):
+        res = conn.execute(
+            "EXPLAIN QUERY PLAN " + managedvolumedb._OWNS_MULTIPATH_SQL,
+            ("mpath-1",))
+        plan = [row[3] for row in res.fetchall()]
+
+    # Plan wording depends on SQLite version, e.g. "SEARCH TABLE volumes" or
+    # "SEARCH volumes".
+    volumes_plan = [detail for detail in plan if "volumes" in detail]
+    assert volumes_plan
+    for detail in volumes_plan:
+        assert "INDEX multipath_id" in detail
+        assert "SCAN" not in detail
+
+
 def test_get_all_volumes(tmp_db):
     expected = [{"vol_id": "vol-id-1",
                  "connection_info": {"connection": 1}},
@@ -261,11 +526,11 @@ def test_concurrency(tmp_db):
     vol_id_tmp = "%06d-%06d"
 
     def run(worker_id):
-        for i in range(iterations):
-            vol_id = vol_id_tmp % (worker_id, i)
+        db = managedvolumedb.open()
+        with closing(db):
+            for i in range(iterations):
+                vol_id = vol_id_tmp % (worker_id, i)
 
-            db = managedvolumedb.open()
-            with closing(db):
                 # Simulate attach volume flow.
 
                 db.add_volume(vol_id, {"connection": vol_id})
@@ -280,9 +545,9 @@ def test_concurrency(tmp_db):
                     multipath_id=vol_id,
                     attachment={"attachment": vol_id})
 
-            # Switch to another thread. Real code will process another
-            # unrelated request here.
-            time.sleep(delay)
+                # Switch to another thread. Real code will process another
+                # unrelated request here.
+                time.sleep(delay)
 
     start = time.time()
 
@@ -336,7 +601,7 @@ def test_lookup_benchmark(tmp_db):
 
     db = managedvolumedb.open()
     with closing(db):
-        # Access db._conn directly for faster import with single transaction.
+        # Access db._conn directly for faster import.
         insert_volume = """
             INSERT INTO volumes (
                 vol_id,
@@ -350,7 +615,7 @@ def test_lookup_benchmark(tmp_db):
                 ?, ?, ?, ?, ?, datetime("now")
             )
         """
-        with db._conn:
+        with db.transaction():
             db._conn.executemany(insert_volume, iter_volumes())
 
     start = time.time()
@@ -35,29 +35,29 @@ Example:
 import os
 import sys
 import traceback
-from xml.dom import minidom
+import xml.etree.ElementTree as etree
 
 import hooking
 
+_DISK_DEVS = frozenset(['disk', 'lun'])
+_DISK_BUSES = frozenset(['scsi', 'ide'])
+
 
 def addDiscardUnmap(domxml):
-    for disk in domxml.getElementsByTagName('disk'):
-        device = disk.getAttribute('device')
-        target = disk.getElementsByTagName('target')[0]
-        bus = target.getAttribute('bus')
-        if ((device == 'disk' or device == 'lun')
-           and (bus == 'scsi' or bus == 'ide')):
-            driver = disk.getElementsByTagName('driver')[0]
-            driver.setAttribute('discard', 'unmap')
+    for disk in domxml.iter('disk'):
+        device = disk.get('device')
+        bus = disk.find('target').get('bus')
+        if device in _DISK_DEVS and bus in _DISK_BUSES:
+            disk.find('driver').set('discard', 'unmap')
 
 
 def main():
     if 'diskunmap' in os.environ:
         unmapConfig = os.environ['diskunmap']
-        domxml = hooking.read_domxml()
+        domxml = hooking.read_domxml_tree()
         if unmapConfig == 'on':
             addDiscardUnmap(domxml)
-            hooking.write_domxml(domxml)
+            hooking.write_domxml_tree(domxml)
 
 
 def test():
@@ -72,16 +72,14 @@ b4cf7d74-6a07-4138-9d4f-80b14c3acefd/images/
 name="qemu" type="raw"/>
 </disk>'''
 
-    xmldom = minidom.parseString(text)
-
-    disk = xmldom.getElementsByTagName('disk')[0]
+    disk = etree.fromstring(text)
     print("\nDisk device definition before execution: \n%s"
-          % disk.toxml(encoding='UTF-8'))
+          % etree.tostring(disk, encoding='unicode'))
 
-    addDiscardUnmap(xmldom)
+    addDiscardUnmap(disk)
 
     print("\nDisk device after setting discard attribute: \n%s"
-          % disk.toxml(encoding='UTF-8'))
+          % etree.tostring(disk, encoding='unicode'))
 
 
 if __name__ == '__main__':